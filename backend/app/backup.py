@@ -0,0 +1,381 @@
+import argparse
+import asyncio
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import DATABASE_PATH
+from .writer import serialized_write
+
+try:
+    import fcntl
+except ImportError:  # Windowsなど、fcntlが使えない環境ではプロセス内のロックのみ
+    fcntl = None
+
+# バックアップの保存先
+BACKUP_DIR = "./data/backups"
+
+# 保持するバックアップの世代数
+BACKUP_KEEP = 7
+
+# 一度のステップでコピーするページ数
+# ステップの合間に他の接続が書き込めるため、リクエストをブロックしない
+BACKUP_PAGES_PER_STEP = 256
+
+# 定期バックアップの間隔（時間）。0の場合は定期バックアップを行わない
+BACKUP_INTERVAL_HOURS = float(os.environ.get("BACKUP_INTERVAL_HOURS", "24"))
+
+_BACKUP_PREFIX = "financial_manager-"
+_BACKUP_SUFFIX = ".db"
+_CHECKSUM_SUFFIX = ".sha256"
+
+# 同一プロセス内でバックアップを直列化するロック
+_backup_lock = threading.Lock()
+
+ProgressCallback = Callable[[int, int], None]
+
+
+@contextmanager
+def _locked_backup_dir(backup_dir: str):
+    """
+    バックアップの作成とローテーションを直列化します。
+    スレッド間はプロセス内のロックで、ワーカープロセス間はバックアップ先の
+    ロックファイルで排他します。
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    with _backup_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(backup_dir, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _checksum(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _read_checksum(path: str) -> Optional[str]:
+    try:
+        with open(path + _CHECKSUM_SUFFIX) as f:
+            return f.read().split()[0]
+    except (FileNotFoundError, IndexError):
+        return None
+
+
+def _backup_info(path: str) -> Dict[str, Any]:
+    stat = os.stat(path)
+    return {
+        "name": os.path.basename(path),
+        "size": stat.st_size,
+        "sha256": _read_checksum(path),
+        "created_at": datetime.fromtimestamp(stat.st_mtime),
+    }
+
+
+def list_backups(backup_dir: str = BACKUP_DIR) -> List[Dict[str, Any]]:
+    """
+    バックアップの一覧を新しい順に取得します。
+    """
+    if not os.path.isdir(backup_dir):
+        return []
+    names = sorted(
+        (
+            name for name in os.listdir(backup_dir)
+            if name.startswith(_BACKUP_PREFIX) and name.endswith(_BACKUP_SUFFIX)
+        ),
+        reverse=True,
+    )
+    backups = []
+    for name in names:
+        try:
+            backups.append(_backup_info(os.path.join(backup_dir, name)))
+        except FileNotFoundError:
+            # 一覧の取得中にローテーションで削除された
+            continue
+    return backups
+
+
+def _backup_path(name: str, backup_dir: str) -> str:
+    # 一覧に存在する名前のみ受け付け、任意のパスを指定させない
+    if name not in {backup["name"] for backup in list_backups(backup_dir)}:
+        raise FileNotFoundError(name)
+    return os.path.join(backup_dir, name)
+
+
+def verify_backup(name: str, backup_dir: str = BACKUP_DIR) -> bool:
+    """
+    バックアップのチェックサムを検証します。
+    """
+    path = _backup_path(name, backup_dir)
+    expected = _read_checksum(path)
+    return expected is not None and expected == _checksum(path)
+
+
+def rotate_backups(backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP) -> List[str]:
+    """
+    古いバックアップを削除し、新しいものから指定世代数だけ残します。
+    削除したバックアップの名前を返します。
+    """
+    removed = []
+    for backup in list_backups(backup_dir)[keep:]:
+        path = os.path.join(backup_dir, backup["name"])
+        for target in (path, path + _CHECKSUM_SUFFIX):
+            try:
+                os.remove(target)
+            except FileNotFoundError:
+                # 他のプロセスがすでに削除している
+                pass
+        removed.append(backup["name"])
+    return removed
+
+
+def _newest_backup_age(backup_dir: str) -> Optional[float]:
+    backups = list_backups(backup_dir)
+    if not backups:
+        return None
+    return (datetime.now() - backups[0]["created_at"]).total_seconds()
+
+
+def _create_backup_locked(
+    backup_dir: str,
+    database_path: str,
+    keep: int,
+    progress: Optional[ProgressCallback],
+) -> Dict[str, Any]:
+    started = time.perf_counter()
+    name = f"{_BACKUP_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}{_BACKUP_SUFFIX}"
+    path = os.path.join(backup_dir, name)
+    tmp_path = path + ".tmp"
+    pages = 0
+
+    def _on_progress(status, remaining, total):
+        nonlocal pages
+        pages = total
+        if progress:
+            progress(total - remaining, total)
+
+    source = sqlite3.connect(database_path, timeout=30)
+    target = sqlite3.connect(tmp_path)
+    try:
+        source.backup(target, pages=BACKUP_PAGES_PER_STEP, progress=_on_progress)
+        # バックアップ単体で完結するファイルにする
+        target.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        target.close()
+        source.close()
+
+    checksum = _checksum(tmp_path)
+    os.replace(tmp_path, path)
+    with open(path + _CHECKSUM_SUFFIX, "w") as f:
+        f.write(f"{checksum}  {name}\n")
+
+    rotated = rotate_backups(backup_dir, keep)
+
+    result = _backup_info(path)
+    result.update({
+        "pages": pages,
+        "elapsed_seconds": time.perf_counter() - started,
+        "rotated": rotated,
+    })
+    return result
+
+
+def create_backup(
+    backup_dir: str = BACKUP_DIR,
+    database_path: str = DATABASE_PATH,
+    keep: int = BACKUP_KEEP,
+    progress: Optional[ProgressCallback] = None,
+) -> Dict[str, Any]:
+    """
+    SQLiteのオンラインバックアップAPIを使って、稼働中のデータベースをバックアップします。
+    ページ単位のステップでコピーするため、バックアップ中も読み書きを受け付けます。
+    progressには、コピー済みページ数と総ページ数が渡されます。
+    """
+    with _locked_backup_dir(backup_dir):
+        return _create_backup_locked(backup_dir, database_path, keep, progress)
+
+
+def create_backup_if_due(
+    min_age_seconds: float,
+    backup_dir: str = BACKUP_DIR,
+    database_path: str = DATABASE_PATH,
+    keep: int = BACKUP_KEEP,
+) -> Optional[Dict[str, Any]]:
+    """
+    最新のバックアップが指定した秒数より古い場合にだけバックアップを作成します。
+    確認から作成・ローテーションまでをロックの中で行うため、複数ワーカーが
+    同時に呼び出してもバックアップは一つだけ作られます。作成しなかった場合はNoneを返します。
+    """
+    with _locked_backup_dir(backup_dir):
+        age = _newest_backup_age(backup_dir)
+        if age is not None and age < min_age_seconds:
+            return None
+        return _create_backup_locked(backup_dir, database_path, keep, None)
+
+
+def _read_data_version(connection: sqlite3.Connection) -> int:
+    try:
+        row = connection.execute(
+            "SELECT version FROM data_version WHERE id = 1"
+        ).fetchone()
+    except sqlite3.OperationalError:
+        # data_versionテーブルがない古いデータベース
+        return 0
+    return row[0] if row else 0
+
+
+def restore_backup(
+    name: str,
+    backup_dir: str = BACKUP_DIR,
+    database_path: str = DATABASE_PATH,
+    progress: Optional[Callable[[str], None]] = None,
+) -> Dict[str, Any]:
+    """
+    バックアップからデータベースを復元します。
+    チェックサムを検証したうえで、書き込みを止めた状態でSQLiteのバックアップAPIを使って
+    稼働中のデータベースに上書きコピーします。ファイルを差し替えないため、
+    接続済みのセッションや他のワーカーも含めて全ての接続が復元後のデータを参照します。
+    """
+    started = time.perf_counter()
+
+    def _report(step):
+        if progress:
+            progress(step)
+
+    path = _backup_path(name, backup_dir)
+    _report("verifying")
+    if not verify_backup(name, backup_dir):
+        raise ValueError(f"バックアップ {name} のチェックサムが一致しません")
+
+    with serialized_write(database_path):
+        # 同時に実行された他の復元と一時ファイルを共有しないよう、ロックの中で
+        # 一意な一時ファイルにコピーしてからデータバージョンを書き換える
+        _report("copying")
+        fd, tmp_path = tempfile.mkstemp(
+            suffix=".restore", dir=os.path.dirname(os.path.abspath(database_path))
+        )
+        os.close(fd)
+        try:
+            shutil.copyfile(path, tmp_path)
+            # 一時ファイルが消えていた場合に空のデータベースを作らないよう、
+            # 既存のファイルだけを開く
+            tmp_uri = f"file:{tmp_path}?mode=rw"
+
+            live = sqlite3.connect(database_path, timeout=30)
+            try:
+                # 各ワーカーのキャッシュが確実に再構築されるよう、
+                # 復元するデータのバージョンを現在より先に進めておく
+                _report("preparing")
+                current_version = _read_data_version(live)
+                restored_engine = create_engine(
+                    "sqlite://", creator=lambda: sqlite3.connect(tmp_uri, uri=True)
+                )
+                try:
+                    models.Base.metadata.create_all(bind=restored_engine)
+                    with Session(restored_engine) as db:
+                        row = db.get(models.DataVersion, 1)
+                        if row is None:
+                            row = models.DataVersion(id=1, version=0)
+                            db.add(row)
+                        row.version = max(current_version, row.version) + 1
+                        db.commit()
+                finally:
+                    restored_engine.dispose()
+
+                def _on_progress(status, remaining, total):
+                    _report(f"restoring {total - remaining}/{total} pages")
+
+                source = sqlite3.connect(tmp_uri, uri=True)
+                try:
+                    source.backup(
+                        live, pages=BACKUP_PAGES_PER_STEP, progress=_on_progress
+                    )
+                finally:
+                    source.close()
+            finally:
+                live.close()
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    _report("done")
+    result = _backup_info(path)
+    result["elapsed_seconds"] = time.perf_counter() - started
+    return result
+
+
+async def run_scheduled_backups(interval_hours: float = BACKUP_INTERVAL_HOURS):
+    """
+    起動時と、その後は指定された間隔で定期的にバックアップを作成し、古いものをローテーションします。
+    複数ワーカーで動かしている場合でも、直近のバックアップが新しければ作成しません。
+    """
+    if interval_hours <= 0:
+        return
+    interval = interval_hours * 3600
+    # 起動時にも確認し、間隔より短い周期で再起動されてもバックアップが作られるようにする
+    min_age = interval
+    while True:
+        try:
+            await asyncio.to_thread(create_backup_if_due, min_age)
+        except Exception as e:
+            print(f"Error creating scheduled backup: {str(e)}")
+        min_age = interval / 2
+        await asyncio.sleep(interval)
+
+
+def main(argv: Optional[List[str]] = None):
+    """
+    バックアップのコマンドラインインターフェース
+    """
+    parser = argparse.ArgumentParser(description="データベースのバックアップと復元")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("create", help="バックアップを作成する")
+    subparsers.add_parser("list", help="バックアップの一覧を表示する")
+    verify_parser = subparsers.add_parser("verify", help="チェックサムを検証する")
+    verify_parser.add_argument("name")
+    restore_parser = subparsers.add_parser("restore", help="バックアップから復元する")
+    restore_parser.add_argument("name")
+    args = parser.parse_args(argv)
+
+    if args.command == "create":
+        result = create_backup(
+            progress=lambda done, total: print(f"{done}/{total} pages", flush=True)
+        )
+        print(f"Created {result['name']} ({result['size']} bytes) "
+              f"in {result['elapsed_seconds']:.3f}s")
+        for name in result["rotated"]:
+            print(f"Removed {name}")
+    elif args.command == "list":
+        for backup in list_backups():
+            print(f"{backup['name']}\t{backup['size']}\t{backup['sha256']}")
+    elif args.command == "verify":
+        ok = verify_backup(args.name)
+        print("OK" if ok else "Checksum mismatch")
+        raise SystemExit(0 if ok else 1)
+    elif args.command == "restore":
+        result = restore_backup(args.name, progress=lambda step: print(step, flush=True))
+        print(f"Restored {result['name']} in {result['elapsed_seconds']:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,10 +7,28 @@ import pandas as pd
 import random
 
 from . import models, schemas
+from .performance_cache import (
+    compute_performance, load_assets, load_history, performance_cache
+)
+from .portfolio_state import portfolio_state
+from .writer import serialized_write, bump_data_version
 
 # 資産関連のCRUD操作
 
 
+def _refresh_performance_cache(db: Session):
+    """
+    書き込み後に標準期間のパフォーマンスを再計算します。
+    書き込みはすでにコミット済みのため、失敗してもエラーにせず、
+    キャッシュを破棄して次回の読み取り時に再計算させます。
+    """
+    try:
+        performance_cache.refresh(db)
+    except Exception as e:
+        print(f"Error refreshing performance cache: {str(e)}")
+        performance_cache.invalidate()
+
+
 def get_asset(db: Session, asset_id: int) -> Optional[models.Asset]:
     """
     指定されたIDの資産を取得します。
@@ -18,6 +36,20 @@ def get_asset(db: Session, asset_id: int) -> Optional[models.Asset]:
     return db.query(models.Asset).filter(models.Asset.id == asset_id).first()
 
 
+def _reload_asset(db: Session, asset_id: int) -> Optional[models.Asset]:
+    """
+    指定されたIDの資産をデータベースから読み直します。
+    書き込みロックの外で読み込んだ資産は他のワーカーに更新されている可能性があるため、
+    serialized_write() の中で値を計算する前に呼び出してください。
+    """
+    return (
+        db.query(models.Asset)
+        .populate_existing()
+        .filter(models.Asset.id == asset_id)
+        .first()
+    )
+
+
 def get_assets(db: Session, skip: int = 0, limit: int = 100) -> List[models.Asset]:
     """
     全ての資産を取得します。
@@ -46,51 +78,71 @@ def create_asset(db: Session, asset: schemas.AssetCreate) -> models.Asset:
         last_updated=datetime.now()
     )
 
-    # データベースに追加して保存
-    db.add(db_asset)
-    db.commit()
-    db.refresh(db_asset)
-
-    # 価格履歴に初期データを追加
-    price_history = models.PriceHistory(
-        asset_id=db_asset.id,
-        date=datetime.now().date(),
-        price=current_price,
-        value=db_asset.current_value
-    )
-    db.add(price_history)
-    db.commit()
+    with serialized_write():
+        # データベースに追加してIDを確定
+        db.add(db_asset)
+        db.flush()
+
+        # 価格履歴に初期データを追加
+        price_history = models.PriceHistory(
+            asset_id=db_asset.id,
+            date=datetime.now().date(),
+            price=current_price,
+            value=db_asset.current_value
+        )
+        db.add(price_history)
+        version = bump_data_version(db)
+        db.commit()
+        db.refresh(db_asset)
 
+    portfolio_state.upsert(db_asset, version)
+    _refresh_performance_cache(db)
     return db_asset
 
 
-def update_asset(db: Session, asset_id: int, asset_update: schemas.AssetUpdate) -> models.Asset:
+def update_asset(db: Session, asset_id: int, asset_update: schemas.AssetUpdate) -> Optional[models.Asset]:
     """
     指定されたIDの資産を更新します。
+    資産が見つからない場合はNoneを返します。
     """
-    db_asset = get_asset(db, asset_id)
+    with serialized_write():
+        db_asset = _reload_asset(db, asset_id)
+        if db_asset is None:
+            return None
 
-    # 更新するフィールドを設定
-    update_data = asset_update.model_dump(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(db_asset, key, value)
+        # 更新するフィールドを設定
+        update_data = asset_update.model_dump(exclude_unset=True)
+        for key, value in update_data.items():
+            setattr(db_asset, key, value)
 
-    # 現在の価値と変化率を更新
-    db_asset.update_current_value()
-    db_asset.last_updated = datetime.now()
+        # 現在の価値と変化率を更新
+        db_asset.update_current_value()
+        db_asset.last_updated = datetime.now()
 
-    db.commit()
-    db.refresh(db_asset)
+        version = bump_data_version(db)
+        db.commit()
+        db.refresh(db_asset)
+
+    portfolio_state.upsert(db_asset, version)
+    _refresh_performance_cache(db)
     return db_asset
 
 
-def delete_asset(db: Session, asset_id: int) -> models.Asset:
+def delete_asset(db: Session, asset_id: int) -> Optional[models.Asset]:
     """
     指定されたIDの資産を削除します。
-    """
-    db_asset = get_asset(db, asset_id)
-    db.delete(db_asset)
-    db.commit()
+    資産が見つからない場合はNoneを返します。
+    """
+    with serialized_write():
+        db_asset = _reload_asset(db, asset_id)
+        if db_asset is None:
+            return None
+        db.delete(db_asset)
+        version = bump_data_version(db)
+        db.commit()
+
+    portfolio_state.remove(asset_id, version)
+    _refresh_performance_cache(db)
     return db_asset
 
 
@@ -98,35 +150,8 @@ def get_assets_summary(db: Session) -> Dict[str, Any]:
     """
     全ての資産の概要を取得します。
     """
-    assets = get_assets(db)
-
-    # 合計値の計算
-    total_value = sum(asset.current_value for asset in assets)
-    total_cost = sum(asset.purchase_price * asset.quantity for asset in assets)
-    total_gain_loss = total_value - total_cost
-
-    # パフォーマンスの計算（%）
-    total_performance = (total_gain_loss / total_cost *
-                         100) if total_cost > 0 else 0
-
-    # 資産配分の計算
-    asset_types = {}
-    for asset in assets:
-        if asset.type in asset_types:
-            asset_types[asset.type] += asset.current_value
-        else:
-            asset_types[asset.type] = asset.current_value
-
-    asset_allocation = [{"type": k, "value": v}
-                        for k, v in asset_types.items()]
-
-    return {
-        "total_value": total_value,
-        "total_cost": total_cost,
-        "total_gain_loss": total_gain_loss,
-        "total_performance": total_performance,
-        "asset_allocation": asset_allocation
-    }
+    # プロセス内の配列ベースの状態からORMオブジェクトを生成せずに計算する
+    return portfolio_state.summary(db)
 
 # 価格更新関連のCRUD操作
 
@@ -136,7 +161,9 @@ def update_prices(db: Session, asset_ids: List[int]) -> List[models.Asset]:
     指定された資産の価格を更新します。
     """
     updated_assets = []
+    new_prices = []
 
+    # 外部APIへの問い合わせは書き込みロックの外で行う
     for asset_id in asset_ids:
         asset = get_asset(db, asset_id)
         if not asset:
@@ -156,6 +183,21 @@ def update_prices(db: Session, asset_ids: List[int]) -> List[models.Asset]:
                 print(f"No data available for {asset.ticker}")
                 continue
 
+            new_prices.append((asset.id, new_price))
+        except Exception as e:
+            print(f"Error updating price for asset {asset.id}: {str(e)}")
+
+    # 更新する価格がなければ書き込まない（各ワーカーのキャッシュを無効にしない）
+    if not new_prices:
+        return updated_assets
+
+    with serialized_write():
+        for asset_id, new_price in new_prices:
+            # 問い合わせ中に他の書き込みで変わっている可能性があるため読み直す
+            asset = _reload_asset(db, asset_id)
+            if not asset:
+                continue
+
             # 資産の価格を更新
             asset.current_price = new_price
             asset.update_current_value()
@@ -169,10 +211,18 @@ def update_prices(db: Session, asset_ids: List[int]) -> List[models.Asset]:
                 value=asset.current_value
             )
             db.add(price_history)
-        except Exception as e:
-            print(f"Error updating price for asset {asset.id}: {str(e)}")
+            updated_assets.append(asset)
 
-    db.commit()
+        if not updated_assets:
+            db.rollback()
+            return updated_assets
+
+        version = bump_data_version(db)
+        db.commit()
+
+    for asset in updated_assets:
+        portfolio_state.upsert(asset, version)
+    _refresh_performance_cache(db)
     print(f'{updated_assets=}')
     return updated_assets
 
@@ -187,86 +237,12 @@ def get_performance(db: Session, start_date: str, end_date: str) -> schemas.Port
     start = datetime.strptime(start_date, "%Y-%m-%d").date()
     end = datetime.strptime(end_date, "%Y-%m-%d").date()
 
-    # 全ての資産を取得
-    assets = get_assets(db)
-
-    # 各資産のパフォーマンスデータを取得
-    assets_performance = []
-    all_values_by_date = {}  # 日付ごとの全資産の合計価値
-
-    for asset in assets:
-        # 価格履歴を取得
-        price_history = (
-            db.query(models.PriceHistory)
-            .filter(
-                models.PriceHistory.asset_id == asset.id,
-                models.PriceHistory.date >= start,
-                models.PriceHistory.date <= end
-            )
-            .order_by(models.PriceHistory.date)
-            .all()
-        )
-
-        # 価格履歴がない場合はスキップ
-        if not price_history:
-            continue
-
-        # 最初の価格を基準にパフォーマンスを計算
-        base_value = price_history[0].value
-        performance_data = []
-
-        for ph in price_history:
-            # 変化率を計算（%）
-            change_percent = ((ph.value / base_value) - 1) * \
-                100 if base_value > 0 else 0
+    # 標準の期間であれば事前計算した結果を返す
+    cached = performance_cache.get(db, start, end)
+    if cached is not None:
+        return cached
 
-            # 日付文字列
-            date_str = ph.date.strftime("%Y-%m-%d")
-
-            # パフォーマンスデータを追加
-            performance_data.append({
-                "date": date_str,
-                "value": ph.value,
-                "change_percent": change_percent
-            })
-
-            # 全資産の合計価値を日付ごとに集計
-            if date_str in all_values_by_date:
-                all_values_by_date[date_str] += ph.value
-            else:
-                all_values_by_date[date_str] = ph.value
-
-        # 資産のパフォーマンスデータを追加
-        assets_performance.append({
-            "id": asset.id,
-            "name": asset.name,
-            "ticker": asset.ticker,
-            "type": asset.type,
-            "performance": performance_data
-        })
-
-    # ポートフォリオ全体のパフォーマンスを計算
-    total_performance = []
-
-    # 日付でソート
-    dates = sorted(all_values_by_date.keys())
-
-    if dates:
-        # 最初の合計価値を基準にパフォーマンスを計算
-        base_total_value = all_values_by_date[dates[0]]
-
-        for date in dates:
-            total_value = all_values_by_date[date]
-            change_percent = ((total_value / base_total_value) -
-                              1) * 100 if base_total_value > 0 else 0
-
-            total_performance.append({
-                "date": date,
-                "value": total_value,
-                "change_percent": change_percent
-            })
-
-    return {
-        "total_performance": total_performance,
-        "assets_performance": assets_performance
-    }
+    # それ以外の期間は、期間内の価格履歴を一度に取得して計算する
+    return compute_performance(
+        load_assets(db), load_history(db, start, end), start, end
+    )
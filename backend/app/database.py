@@ -1,17 +1,26 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 import os
 
 # データベースのパス
 # Dockerコンテナ内では/app/dataディレクトリにマウントされる
-DATABASE_URL = "sqlite:///./data/financial_manager.db"
+DATABASE_PATH = "./data/financial_manager.db"
+DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
 
 # SQLiteの接続設定
 # check_same_thread=Falseは、SQLiteを複数のスレッドで使用するための設定
+# timeoutは、他の接続がロックを保持している場合に待機する秒数
 engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False}
+    DATABASE_URL, connect_args={"check_same_thread": False, "timeout": 30}
 )
 
+# WALモードにして、書き込み中も他のワーカーからの読み取りをブロックしない
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragma(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
 # セッションの作成
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
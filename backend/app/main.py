@@ -1,18 +1,36 @@
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
+from contextlib import asynccontextmanager
 from typing import List, Optional
 import os
 from datetime import datetime, timedelta
 
-from .database import get_db, engine
-from . import models, schemas, crud
+from .database import get_db, engine, SessionLocal
+from . import models, schemas, crud, backup
+from .performance_cache import performance_cache
+from .portfolio_state import portfolio_state
+from .writer import serialized_write
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 
 # データベースの初期化
-models.Base.metadata.create_all(bind=engine)
+# 複数ワーカーが同時に起動してもテーブル作成が競合しないよう直列化する
+with serialized_write():
+    models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="金融資産マネジメントAPI")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 起動時にポートフォリオ状態と標準期間のパフォーマンスを構築する
+    with SessionLocal() as db:
+        portfolio_state.rebuild(db)
+        performance_cache.refresh(db)
+    # 定期バックアップを開始する
+    backup_task = asyncio.create_task(backup.run_scheduled_backups())
+    yield
+    backup_task.cancel()
+
+app = FastAPI(title="金融資産マネジメントAPI", lifespan=lifespan)
 
 # CORSの設定
 app.add_middleware(
@@ -83,12 +101,18 @@ def update_asset(
             detail=f"ID {asset_id} の資産は見つかりませんでした",
         )
     try:
-        return crud.update_asset(db=db, asset_id=asset_id, asset_update=asset_update)
+        asset = crud.update_asset(db=db, asset_id=asset_id, asset_update=asset_update)
     except SQLAlchemyError as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"データベースエラー: {str(e)}",
         )
+    if asset is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"ID {asset_id} の資産は見つかりませんでした",
+        )
+    return asset
 
 @app.delete("/assets/{asset_id}", response_model=schemas.Asset)
 def delete_asset(asset_id: int, db: Session = Depends(get_db)):
@@ -102,12 +126,18 @@ def delete_asset(asset_id: int, db: Session = Depends(get_db)):
             detail=f"ID {asset_id} の資産は見つかりませんでした",
         )
     try:
-        return crud.delete_asset(db=db, asset_id=asset_id)
+        asset = crud.delete_asset(db=db, asset_id=asset_id)
     except SQLAlchemyError as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"データベースエラー: {str(e)}",
         )
+    if asset is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"ID {asset_id} の資産は見つかりませんでした",
+        )
+    return asset
 
 # 価格更新のエンドポイント
 @app.post("/prices/update", response_model=schemas.PriceUpdateResponse)
@@ -168,3 +198,47 @@ def get_performance(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"パフォーマンス分析エラー: {str(e)}",
         )
+
+# バックアップ・リストアのエンドポイント
+@app.get("/backups", response_model=List[schemas.Backup])
+def list_backups():
+    """
+    バックアップの一覧を新しい順に取得します。
+    """
+    return backup.list_backups()
+
+@app.post("/backups", response_model=schemas.BackupResult)
+def create_backup():
+    """
+    稼働中のデータベースのバックアップを作成します。
+    """
+    try:
+        return backup.create_backup()
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"バックアップエラー: {str(e)}",
+        )
+
+@app.post("/backups/{name}/restore", response_model=schemas.RestoreResult)
+def restore_backup(name: str):
+    """
+    指定されたバックアップからデータベースを復元します。
+    """
+    try:
+        return backup.restore_backup(name)
+    except FileNotFoundError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"バックアップ {name} は見つかりませんでした",
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e),
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"リストアエラー: {str(e)}",
+        )
@@ -47,3 +47,14 @@ class PriceHistory(Base):
     
     # 関連するデータ
     asset = relationship("Asset", back_populates="price_history")
+
+
+class DataVersion(Base):
+    """
+    データバージョンモデル
+    書き込みのたびに値を進め、各ワーカープロセスがキャッシュの鮮度を判定するために使う
+    """
+    __tablename__ = "data_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,237 @@
+import calendar
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models
+from .writer import get_data_version
+
+# パフォーマンス画面で選択できる標準の期間（月数）
+# フロントエンドの期間ボタン（date-fnsのsubMonths/subYears）と同じ開始日になる
+STANDARD_WINDOW_MONTHS = {
+    "1m": 1,
+    "3m": 3,
+    "6m": 6,
+    "1y": 12,
+    "3y": 36,
+}
+
+# 資産ごとの価格履歴（日付のリストと価値のリスト）
+History = Dict[int, Tuple[List[date], List[float]]]
+
+
+def _sub_months(day: date, months: int) -> date:
+    """
+    指定した月数だけ前の日付を返します。存在しない日は月末に丸めます。
+    """
+    month_index = day.year * 12 + day.month - 1 - months
+    year, month = divmod(month_index, 12)
+    month += 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def standard_windows(today: date, first_date: Optional[date]) -> Dict[str, Tuple[date, date]]:
+    """
+    標準の期間ごとの開始日と終了日を返します。
+    """
+    windows = {
+        key: (_sub_months(today, months), today)
+        for key, months in STANDARD_WINDOW_MONTHS.items()
+    }
+    windows["ytd"] = (date(today.year, 1, 1), today)
+    windows["all"] = (first_date or today, today)
+    return windows
+
+
+def load_assets(db: Session) -> List[Any]:
+    """
+    パフォーマンス計算に必要な資産の列だけを取得します。
+    """
+    return (
+        db.query(
+            models.Asset.id,
+            models.Asset.name,
+            models.Asset.ticker,
+            models.Asset.type,
+        )
+        .order_by(models.Asset.id)
+        .all()
+    )
+
+
+def load_history(db: Session, start: Optional[date] = None, end: Optional[date] = None) -> History:
+    """
+    価格履歴を一度のクエリで取得し、資産ごとに日付順に並べます。
+    """
+    query = db.query(
+        models.PriceHistory.asset_id,
+        models.PriceHistory.date,
+        models.PriceHistory.value,
+    )
+    if start is not None:
+        query = query.filter(models.PriceHistory.date >= start)
+    if end is not None:
+        query = query.filter(models.PriceHistory.date <= end)
+    rows = query.order_by(models.PriceHistory.date, models.PriceHistory.id).all()
+
+    history: History = {}
+    for asset_id, day, value in rows:
+        dates, values = history.setdefault(asset_id, ([], []))
+        dates.append(day)
+        values.append(value)
+    return history
+
+
+def compute_performance(assets: List[Any], history: History, start: date, end: date) -> Dict[str, Any]:
+    """
+    資産と価格履歴から、指定された期間のパフォーマンスデータを計算します。
+    """
+    # 各資産のパフォーマンスデータを計算
+    assets_performance = []
+    all_values_by_date = {}  # 日付ごとの全資産の合計価値
+
+    for asset in assets:
+        dates, values = history.get(asset.id, ([], []))
+        lo = bisect_left(dates, start)
+        hi = bisect_right(dates, end)
+
+        # 価格履歴がない場合はスキップ
+        if lo >= hi:
+            continue
+
+        # 最初の価格を基準にパフォーマンスを計算
+        base_value = values[lo]
+        performance_data = []
+
+        for day, value in zip(dates[lo:hi], values[lo:hi]):
+            # 変化率を計算（%）
+            change_percent = ((value / base_value) - 1) * \
+                100 if base_value > 0 else 0
+
+            # 日付文字列
+            date_str = day.strftime("%Y-%m-%d")
+
+            # パフォーマンスデータを追加
+            performance_data.append({
+                "date": date_str,
+                "value": value,
+                "change_percent": change_percent
+            })
+
+            # 全資産の合計価値を日付ごとに集計
+            if date_str in all_values_by_date:
+                all_values_by_date[date_str] += value
+            else:
+                all_values_by_date[date_str] = value
+
+        # 資産のパフォーマンスデータを追加
+        assets_performance.append({
+            "id": asset.id,
+            "name": asset.name,
+            "ticker": asset.ticker,
+            "type": asset.type,
+            "performance": performance_data
+        })
+
+    # ポートフォリオ全体のパフォーマンスを計算
+    total_performance = []
+
+    # 日付でソート
+    dates = sorted(all_values_by_date.keys())
+
+    if dates:
+        # 最初の合計価値を基準にパフォーマンスを計算
+        base_total_value = all_values_by_date[dates[0]]
+
+        for date_str in dates:
+            total_value = all_values_by_date[date_str]
+            change_percent = ((total_value / base_total_value) -
+                              1) * 100 if base_total_value > 0 else 0
+
+            total_performance.append({
+                "date": date_str,
+                "value": total_value,
+                "change_percent": change_percent
+            })
+
+    return {
+        "total_performance": total_performance,
+        "assets_performance": assets_performance
+    }
+
+
+class PerformanceCache:
+    """
+    標準の期間（1M, 3M, 6M, 1Y, 3Y, YTD, ALL）のパフォーマンスを事前計算して保持するキャッシュ
+
+    価格更新や資産の変更のたびにcrudの書き込み処理から再計算されます。
+    他のワーカーによる書き込みや日付の変わり目は、データバージョンと
+    計算した日付を比較して検知し、読み取り時に再計算します。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bind = None  # キャッシュを計算したエンジン
+        self._version = None  # キャッシュが反映しているデータバージョン
+        self._as_of = None  # キャッシュを計算した日付
+        self._first_date = None  # 価格履歴の最初の日付
+        self._results: Dict[Tuple[date, date], Dict[str, Any]] = {}
+
+    def refresh(self, db: Session, today: Optional[date] = None):
+        """
+        全ての標準の期間のパフォーマンスを再計算します。
+        """
+        today = today or date.today()
+        # 先にバージョンを読むことで、読み取り中に書き込みがあっても
+        # 次回の読み取りで再計算されるようにする
+        version = get_data_version(db)
+        assets = load_assets(db)
+        history = load_history(db)
+
+        first_date = min((dates[0] for dates, _ in history.values()), default=None)
+        results = {
+            window: compute_performance(assets, history, *window)
+            for window in standard_windows(today, first_date).values()
+        }
+
+        with self._lock:
+            self._results = results
+            self._first_date = first_date
+            self._bind = db.get_bind()
+            self._version = version
+            self._as_of = today
+
+    def invalidate(self):
+        """
+        キャッシュを破棄し、次回の読み取り時に再計算させます。
+        """
+        with self._lock:
+            self._bind = None
+
+    def get(self, db: Session, start: date, end: date) -> Optional[Dict[str, Any]]:
+        """
+        指定された期間が標準の期間に一致すれば、事前計算した結果を返します。
+        一致しない場合はNoneを返します。
+        """
+        today = date.today()
+        if end != today:
+            return None
+        if (
+            self._bind is not db.get_bind()
+            or self._as_of != today
+            or self._version != get_data_version(db)
+        ):
+            self.refresh(db, today)
+
+        with self._lock:
+            # 価格履歴の最初の日付以前から始まる期間は、全期間と同じ結果になる
+            if self._first_date is not None and start <= self._first_date:
+                start = self._first_date
+            return self._results.get((start, end))
+
+
+# アプリケーション全体で共有するパフォーマンスキャッシュ
+performance_cache = PerformanceCache()
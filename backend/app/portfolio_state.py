@@ -0,0 +1,213 @@
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from . import models
+from .writer import get_data_version
+
+# 配列の初期容量
+_INITIAL_CAPACITY = 64
+
+
+class PortfolioState:
+    """
+    ポートフォリオのサマリー計算用にプロセス内に保持する配列ベースの状態
+
+    資産ごとの数量・取得単価・現在価格・資産種別コードをNumPy配列で保持し、
+    資産IDから行番号を引けるようにしています。crudの書き込み処理から
+    ライトスルーで更新され、サマリーや資産配分の計算はORMオブジェクトを
+    生成せずにベクトル演算で行います。
+
+    複数ワーカーで動かす場合に備えて、構築時のデータバージョンを記録し、
+    他のプロセスによる書き込みを検知したら再構築します。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bind = None  # 状態を構築したエンジン
+        self._version = 0  # 状態が反映しているデータバージョン
+        self._row_by_id: Dict[int, int] = {}
+        self._types: List[str] = []
+        self._type_codes: Dict[str, int] = {}
+        self._size = 0
+        self._allocate(_INITIAL_CAPACITY)
+
+    def _allocate(self, capacity: int):
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.quantity = np.zeros(capacity, dtype=np.float64)
+        self.cost = np.zeros(capacity, dtype=np.float64)
+        self.price = np.zeros(capacity, dtype=np.float64)
+        self.type_code = np.zeros(capacity, dtype=np.int64)
+
+    def _grow(self):
+        size = self._size
+        old = (self.ids, self.quantity, self.cost, self.price, self.type_code)
+        self._allocate(len(self.ids) * 2)
+        for new_array, old_array in zip(
+            (self.ids, self.quantity, self.cost, self.price, self.type_code), old
+        ):
+            new_array[:size] = old_array[:size]
+
+    def _code_for(self, asset_type: Optional[str]) -> int:
+        asset_type = asset_type or ""
+        code = self._type_codes.get(asset_type)
+        if code is None:
+            code = len(self._types)
+            self._types.append(asset_type)
+            self._type_codes[asset_type] = code
+        return code
+
+    def _reset(self):
+        self._row_by_id = {}
+        self._types = []
+        self._type_codes = {}
+        self._size = 0
+        self._allocate(_INITIAL_CAPACITY)
+
+    def _set_row(self, asset_id, quantity, purchase_price, current_price, asset_type):
+        row = self._row_by_id.get(asset_id)
+        if row is None:
+            if self._size == len(self.ids):
+                self._grow()
+            row = self._size
+            self._size += 1
+            self._row_by_id[asset_id] = row
+            self.ids[row] = asset_id
+        self.quantity[row] = quantity or 0.0
+        self.cost[row] = purchase_price or 0.0
+        self.price[row] = current_price or 0.0
+        self.type_code[row] = self._code_for(asset_type)
+
+    def rebuild(self, db: Session):
+        """
+        データベースから状態を再構築します。
+        """
+        # 先にバージョンを読むことで、行の読み取り中に書き込みがあっても
+        # 次回の読み取りで再構築されるようにする
+        version = get_data_version(db)
+        rows = (
+            db.query(
+                models.Asset.id,
+                models.Asset.quantity,
+                models.Asset.purchase_price,
+                models.Asset.current_price,
+                models.Asset.type,
+            )
+            .order_by(models.Asset.id)
+            .all()
+        )
+        with self._lock:
+            self._reset()
+            for row in rows:
+                self._set_row(*row)
+            self._bind = db.get_bind()
+            self._version = version
+
+    def invalidate(self):
+        """
+        状態を破棄し、次回の読み取り時に再構築させます。
+        """
+        with self._lock:
+            self._bind = None
+
+    def _advance(self, version: int) -> bool:
+        """
+        書き込み後のデータバージョンに状態を進めます。
+        直前のバージョンから構築されていない場合は、他のプロセスの書き込みを
+        取りこぼしているため状態を破棄します。
+        """
+        if self._bind is None:
+            return False
+        if self._version == version:
+            return True
+        if self._version == version - 1:
+            self._version = version
+            return True
+        self._bind = None
+        return False
+
+    def upsert(self, asset: models.Asset, version: int):
+        """
+        資産の追加・更新を状態に反映します。
+        """
+        with self._lock:
+            if not self._advance(version):
+                return
+            self._set_row(
+                asset.id,
+                asset.quantity,
+                asset.purchase_price,
+                asset.current_price,
+                asset.type,
+            )
+
+    def remove(self, asset_id: int, version: int):
+        """
+        資産の削除を状態に反映します。末尾の行と入れ替えて詰めます。
+        """
+        with self._lock:
+            if not self._advance(version):
+                return
+            row = self._row_by_id.pop(asset_id, None)
+            if row is None:
+                return
+            last = self._size - 1
+            if row != last:
+                for array in (
+                    self.ids, self.quantity, self.cost, self.price, self.type_code
+                ):
+                    array[row] = array[last]
+                self._row_by_id[int(self.ids[row])] = row
+            self._size = last
+
+    def summary(self, db: Session) -> Dict[str, Any]:
+        """
+        資産全体の概要を計算します。
+        状態が未構築、別のデータベースから構築されている、またはデータバージョンが
+        進んでいる場合は再構築します。
+        """
+        if (
+            self._bind is None
+            or self._bind is not db.get_bind()
+            or self._version != get_data_version(db)
+        ):
+            self.rebuild(db)
+
+        with self._lock:
+            size = self._size
+            quantity = self.quantity[:size]
+            values = quantity * self.price[:size]
+            costs = quantity * self.cost[:size]
+            codes = self.type_code[:size]
+            types = list(self._types)
+
+        # 合計値の計算
+        total_value = float(values.sum())
+        total_cost = float(costs.sum())
+        total_gain_loss = total_value - total_cost
+
+        # パフォーマンスの計算（%）
+        total_performance = (total_gain_loss / total_cost *
+                             100) if total_cost > 0 else 0
+
+        # 資産配分の計算（資産が存在する種別のみ）
+        counts = np.bincount(codes, minlength=len(types))
+        allocation = np.bincount(codes, weights=values, minlength=len(types))
+        asset_allocation = [
+            {"type": types[code], "value": float(allocation[code])}
+            for code in np.flatnonzero(counts)
+        ]
+
+        return {
+            "total_value": total_value,
+            "total_cost": total_cost,
+            "total_gain_loss": total_gain_loss,
+            "total_performance": total_performance,
+            "asset_allocation": asset_allocation
+        }
+
+
+# アプリケーション全体で共有するポートフォリオ状態
+portfolio_state = PortfolioState()
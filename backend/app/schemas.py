@@ -83,3 +83,18 @@ class AssetPerformance(BaseModel):
 class PortfolioPerformance(BaseModel):
     total_performance: List[PerformanceData]
     assets_performance: List[AssetPerformance]
+
+# バックアップスキーマ
+class Backup(BaseModel):
+    name: str
+    size: int
+    sha256: Optional[str] = None
+    created_at: datetime
+
+class BackupResult(Backup):
+    pages: int
+    elapsed_seconds: float
+    rotated: List[str]
+
+class RestoreResult(Backup):
+    elapsed_seconds: float
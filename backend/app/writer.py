@@ -0,0 +1,71 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import DATABASE_PATH
+
+try:
+    import fcntl
+except ImportError:  # Windowsなど、fcntlが使えない環境ではプロセス内のロックのみ
+    fcntl = None
+
+# データバージョンを保持する行のID
+_DATA_VERSION_ID = 1
+
+# 同一プロセス内のスレッド間で書き込みを直列化するロック（データベースごと）
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+def _thread_lock_for(database_path: str) -> threading.Lock:
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(os.path.abspath(database_path), threading.Lock())
+
+
+@contextmanager
+def serialized_write(database_path: str = DATABASE_PATH):
+    """
+    データベースへの書き込みを直列化します。
+    スレッド間はプロセス内のロックで、ワーカープロセス間はデータベースの隣に置く
+    ロックファイル（<データベース>.lock）で排他し、同時に一つの書き込みだけが
+    実行されるようにします。
+    """
+    with _thread_lock_for(database_path):
+        if fcntl is None:
+            yield
+            return
+        with open(f"{database_path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_data_version(db: Session) -> int:
+    """
+    現在のデータバージョンを取得します。
+    """
+    version = (
+        db.query(models.DataVersion.version)
+        .filter(models.DataVersion.id == _DATA_VERSION_ID)
+        .scalar()
+    )
+    return version or 0
+
+
+def bump_data_version(db: Session) -> int:
+    """
+    データバージョンを一つ進め、新しいバージョンを返します。
+    serialized_write() の中で、書き込みと同じトランザクションで呼び出してください。
+    """
+    row = db.get(models.DataVersion, _DATA_VERSION_ID)
+    if row is None:
+        row = models.DataVersion(id=_DATA_VERSION_ID, version=0)
+        db.add(row)
+    row.version += 1
+    db.flush()
+    return row.version
@@ -1,13 +1,21 @@
+import os
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 import datetime
+import pandas as pd
+
+# テスト中は定期バックアップを作成しない
+os.environ.setdefault("BACKUP_INTERVAL_HOURS", "0")
 
 from app.main import app
 from app.database import Base, get_db
-from app import models, schemas
+from app import crud, models, schemas
+from app.performance_cache import performance_cache, standard_windows
+from app.portfolio_state import portfolio_state
+from app.writer import bump_data_version, get_data_version
 
 # テスト用のデータベース設定
 SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
@@ -23,6 +31,9 @@ TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engin
 @pytest.fixture
 def db_session():
     Base.metadata.create_all(bind=engine)
+    # テスト間でポートフォリオ状態を持ち越さない
+    portfolio_state.invalidate()
+    performance_cache.invalidate()
     db = TestingSessionLocal()
     try:
         yield db
@@ -137,3 +148,211 @@ def test_delete_asset(client, sample_asset):
     # 削除後に取得しようとするとエラーになることを確認
     response = client.get(f"/assets/{sample_asset.id}")
     assert response.status_code == 404
+
+# 資産サマリーのテスト
+def test_get_assets_summary(client, sample_asset):
+    response = client.get("/assets")
+    assert response.status_code == 200
+    summary = response.json()["summary"]
+    assert summary["total_value"] == 110000
+    assert summary["total_cost"] == 100000
+    assert summary["total_gain_loss"] == 10000
+    assert summary["total_performance"] == pytest.approx(10.0)
+    assert summary["asset_allocation"] == [{"type": "株式", "value": 110000}]
+
+# 書き込み後に資産サマリーが更新されることのテスト
+def test_assets_summary_follows_writes(client, sample_asset):
+    client.get("/assets")
+
+    asset_data = {
+        "name": "テスト投信",
+        "ticker": "FUND",
+        "type": "投資信託",
+        "quantity": 10,
+        "purchase_price": 500,
+        "purchase_date": datetime.date.today().isoformat()
+    }
+    created = client.post("/assets", json=asset_data).json()
+    summary = client.get("/assets").json()["summary"]
+    assert summary["total_value"] == 115000
+    assert summary["asset_allocation"] == [
+        {"type": "株式", "value": 110000},
+        {"type": "投資信託", "value": 5000},
+    ]
+
+    client.put(f"/assets/{sample_asset.id}", json={"quantity": 200})
+    summary = client.get("/assets").json()["summary"]
+    assert summary["total_value"] == 225000
+    assert summary["total_cost"] == 205000
+
+    client.delete(f"/assets/{sample_asset.id}")
+    summary = client.get("/assets").json()["summary"]
+    assert summary["total_value"] == 5000
+    assert summary["asset_allocation"] == [{"type": "投資信託", "value": 5000}]
+
+    client.delete(f"/assets/{created['id']}")
+    summary = client.get("/assets").json()["summary"]
+    assert summary["total_value"] == 0
+    assert summary["asset_allocation"] == []
+
+# 別プロセスからの書き込みを模して、資産を直接更新する
+def update_asset_elsewhere(asset_id, **values):
+    other = TestingSessionLocal()
+    try:
+        asset = other.get(models.Asset, asset_id)
+        for key, value in values.items():
+            setattr(asset, key, value)
+        asset.update_current_value()
+        bump_data_version(other)
+        other.commit()
+    finally:
+        other.close()
+
+# 他のワーカーによる書き込みで資産サマリーが再構築されることのテスト
+def test_assets_summary_invalidated_by_data_version(client, sample_asset):
+    assert client.get("/assets").json()["summary"]["total_value"] == 110000
+
+    # ライトスルーを経由せずに更新する
+    update_asset_elsewhere(sample_asset.id, current_price=1200)
+
+    assert client.get("/assets").json()["summary"]["total_value"] == 120000
+
+# Yahoo Finance APIの代わりに固定の終値を返す
+class FakeTicker:
+    closes = []
+
+    def __init__(self, ticker):
+        pass
+
+    def history(self, period):
+        return pd.DataFrame({"Close": self.closes})
+
+# 資産更新時に書き込みロックの外で読み込んだ値を使わないことのテスト
+def test_update_asset_uses_latest_values(client, sample_asset):
+    update_asset_elsewhere(sample_asset.id, current_price=1200)
+
+    response = client.put(f"/assets/{sample_asset.id}", json={"quantity": 200})
+    assert response.status_code == 200
+    assert response.json()["current_value"] == 240000
+
+# 存在確認の後に他のワーカーが資産を削除した場合のテスト
+def test_delete_asset_deleted_elsewhere(client, sample_asset, monkeypatch):
+    get_asset = crud.get_asset
+
+    # エンドポイントの存在確認の直後に、別プロセスが資産を削除する
+    def get_asset_then_delete(db, asset_id):
+        asset = get_asset(db, asset_id)
+        other = TestingSessionLocal()
+        try:
+            other.delete(other.get(models.Asset, asset_id))
+            bump_data_version(other)
+            other.commit()
+        finally:
+            other.close()
+        return asset
+    monkeypatch.setattr(crud, "get_asset", get_asset_then_delete)
+
+    response = client.delete(f"/assets/{sample_asset.id}")
+    assert response.status_code == 404
+
+# 価格取得中の他の書き込みを上書きしないことのテスト
+def test_update_prices_uses_latest_values(db_session, sample_asset, monkeypatch):
+    FakeTicker.closes = [1100]
+    monkeypatch.setattr(crud.yf, "Ticker", FakeTicker)
+    original_history = FakeTicker.history
+
+    # 価格の問い合わせ中に他のワーカーが数量を変更する
+    def history(self, period):
+        update_asset_elsewhere(sample_asset.id, quantity=200)
+        return original_history(self, period)
+    monkeypatch.setattr(FakeTicker, "history", history)
+
+    updated = crud.update_prices(db_session, [sample_asset.id])
+    assert [asset.quantity for asset in updated] == [200]
+    assert updated[0].current_value == 220000
+    assert crud.get_assets_summary(db_session)["total_value"] == 220000
+
+# 価格が取得できなかった場合は書き込まないことのテスト
+def test_update_prices_without_prices(db_session, sample_asset, monkeypatch):
+    FakeTicker.closes = []
+    monkeypatch.setattr(crud.yf, "Ticker", FakeTicker)
+    version = get_data_version(db_session)
+
+    assert crud.update_prices(db_session, [sample_asset.id]) == []
+    assert get_data_version(db_session) == version
+
+# テスト用の価格履歴を追加する
+def add_price_history(db, asset, days_ago, price):
+    db.add(models.PriceHistory(
+        asset_id=asset.id,
+        date=datetime.date.today() - datetime.timedelta(days=days_ago),
+        price=price,
+        value=asset.quantity * price
+    ))
+    bump_data_version(db)
+    db.commit()
+
+# 標準の期間のパフォーマンスが事前計算した結果から返されることのテスト
+def test_get_performance_standard_window(client, db_session, sample_asset):
+    add_price_history(db_session, sample_asset, 40, 900)
+    add_price_history(db_session, sample_asset, 10, 1000)
+    add_price_history(db_session, sample_asset, 0, 1100)
+
+    today = datetime.date.today()
+    start, end = standard_windows(today, None)["1m"]
+    response = client.get(f"/performance?start_date={start}&end_date={end}")
+    assert response.status_code == 200
+    data = response.json()
+    assert [p["value"] for p in data["total_performance"]] == [100000, 110000]
+    assert data["total_performance"][-1]["change_percent"] == pytest.approx(10.0)
+    assert performance_cache.get(db_session, start, end) is not None
+
+    # 標準の期間以外はその場で計算し、同じ結果になる
+    custom = start - datetime.timedelta(days=1)
+    assert performance_cache.get(db_session, custom, end) is None
+    response = client.get(f"/performance?start_date={custom}&end_date={end}")
+    assert response.json() == data
+
+    # 価格履歴の最初の日付以前から始まる期間は全期間の結果になる
+    response = client.get(f"/performance?start_date=2000-01-01&end_date={end}")
+    assert [p["value"] for p in response.json()["total_performance"]] == [
+        90000, 100000, 110000
+    ]
+
+# 書き込み後に事前計算したパフォーマンスが更新されることのテスト
+def test_get_performance_refreshed_after_write(client, db_session, sample_asset):
+    add_price_history(db_session, sample_asset, 10, 1000)
+    start, end = standard_windows(datetime.date.today(), None)["3m"]
+    url = f"/performance?start_date={start}&end_date={end}"
+    assert len(client.get(url).json()["total_performance"]) == 1
+
+    add_price_history(db_session, sample_asset, 0, 1200)
+    data = client.get(url).json()
+    assert [p["value"] for p in data["total_performance"]] == [100000, 120000]
+
+    client.delete(f"/assets/{sample_asset.id}")
+    data = client.get(url).json()
+    assert data == {"total_performance": [], "assets_performance": []}
+
+# パフォーマンスの再計算に失敗しても書き込みは成功することのテスト
+def test_write_succeeds_when_performance_refresh_fails(client, db_session, monkeypatch):
+    def refresh(db, today=None):
+        raise RuntimeError("refresh failed")
+    monkeypatch.setattr(performance_cache, "refresh", refresh)
+
+    asset_data = {
+        "name": "新規テスト株式",
+        "ticker": "NEWTEST",
+        "type": "株式",
+        "quantity": 50,
+        "purchase_price": 2000,
+        "purchase_date": datetime.date.today().isoformat()
+    }
+    response = client.post("/assets", json=asset_data)
+    assert response.status_code == 200
+    monkeypatch.undo()
+
+    # キャッシュは破棄され、次の読み取りで再計算される
+    start, end = standard_windows(datetime.date.today(), None)["1m"]
+    data = client.get(f"/performance?start_date={start}&end_date={end}").json()
+    assert [p["value"] for p in data["total_performance"]] == [100000]
@@ -0,0 +1,208 @@
+import os
+import threading
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+import datetime
+
+from app import backup, models
+from app.database import Base
+from app.writer import bump_data_version, get_data_version
+
+# テスト用のファイルデータベース
+@pytest.fixture
+def database(tmp_path):
+    database_path = str(tmp_path / "financial_manager.db")
+    engine = create_engine(f"sqlite:///{database_path}")
+
+    # 本番と同じくWALモードで開く
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragma(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
+    Base.metadata.create_all(bind=engine)
+    yield database_path, engine
+    engine.dispose()
+
+@pytest.fixture
+def backup_dir(tmp_path):
+    return str(tmp_path / "backups")
+
+def add_asset(engine, name):
+    with Session(engine) as db:
+        db.add(models.Asset(
+            name=name,
+            ticker="TEST",
+            type="株式",
+            quantity=100,
+            purchase_price=1000,
+            purchase_date=datetime.date.today(),
+            current_price=1000,
+            current_value=100000,
+            performance=0.0,
+        ))
+        bump_data_version(db)
+        db.commit()
+
+def asset_names(engine):
+    with Session(engine) as db:
+        return [asset.name for asset in db.query(models.Asset).order_by(models.Asset.id)]
+
+# バックアップ作成のテスト
+def test_create_backup(database, backup_dir):
+    database_path, engine = database
+    add_asset(engine, "テスト株式")
+
+    progress = []
+    result = backup.create_backup(
+        backup_dir=backup_dir,
+        database_path=database_path,
+        progress=lambda done, total: progress.append((done, total)),
+    )
+    assert result["pages"] > 0
+    assert progress[-1] == (result["pages"], result["pages"])
+    assert result["sha256"] is not None
+    assert backup.verify_backup(result["name"], backup_dir)
+    assert [b["name"] for b in backup.list_backups(backup_dir)] == [result["name"]]
+
+# バックアップのローテーションのテスト
+def test_rotate_backups(database, backup_dir):
+    database_path, engine = database
+    names = [
+        backup.create_backup(backup_dir=backup_dir, database_path=database_path, keep=2)["name"]
+        for _ in range(3)
+    ]
+    assert [b["name"] for b in backup.list_backups(backup_dir)] == names[:0:-1]
+
+# 他のプロセスがすでに削除したバックアップがあってもローテーションが続くことのテスト
+def test_rotate_backups_tolerates_missing_files(database, backup_dir, monkeypatch):
+    database_path, engine = database
+    for _ in range(3):
+        backup.create_backup(backup_dir=backup_dir, database_path=database_path)
+    backups = backup.list_backups(backup_dir)
+    os.remove(f"{backup_dir}/{backups[-1]['name']}")
+    monkeypatch.setattr(backup, "list_backups", lambda backup_dir: backups)
+
+    assert backup.rotate_backups(backup_dir, keep=1) == [b["name"] for b in backups[1:]]
+
+# 定期バックアップが直近のバックアップがあれば作成しないことのテスト
+def test_create_backup_if_due(database, backup_dir):
+    database_path, engine = database
+    first = backup.create_backup_if_due(
+        3600, backup_dir=backup_dir, database_path=database_path
+    )
+    assert first is not None
+    assert backup.create_backup_if_due(
+        3600, backup_dir=backup_dir, database_path=database_path
+    ) is None
+    assert [b["name"] for b in backup.list_backups(backup_dir)] == [first["name"]]
+
+# 破損したバックアップのテスト
+def test_corrupted_backup_is_not_restored(database, backup_dir):
+    database_path, engine = database
+    name = backup.create_backup(backup_dir=backup_dir, database_path=database_path)["name"]
+    with open(f"{backup_dir}/{name}", "ab") as f:
+        f.write(b"corrupted")
+
+    assert not backup.verify_backup(name, backup_dir)
+    with pytest.raises(ValueError):
+        backup.restore_backup(
+            name, backup_dir=backup_dir, database_path=database_path
+        )
+
+# 存在しないバックアップのテスト
+def test_restore_unknown_backup(database, backup_dir):
+    database_path, engine = database
+    with pytest.raises(FileNotFoundError):
+        backup.restore_backup(
+            "../financial_manager.db",
+            backup_dir=backup_dir,
+            database_path=database_path,
+        )
+
+# リストアのテスト
+def test_restore_backup(database, backup_dir):
+    database_path, engine = database
+    add_asset(engine, "復元前の資産")
+    name = backup.create_backup(backup_dir=backup_dir, database_path=database_path)["name"]
+    add_asset(engine, "バックアップ後の資産")
+    with Session(engine) as db:
+        version_before = get_data_version(db)
+
+    steps = []
+    result = backup.restore_backup(
+        name,
+        backup_dir=backup_dir,
+        database_path=database_path,
+        progress=steps.append,
+    )
+    assert result["name"] == name
+    assert steps[-1] == "done"
+    # 書き込みロックは復元先のデータベースの隣に置かれる
+    assert os.path.exists(database_path + ".lock")
+    assert asset_names(engine) == ["復元前の資産"]
+    # キャッシュが再構築されるよう、データバージョンは復元前より進んでいる
+    with Session(engine) as db:
+        assert get_data_version(db) > version_before
+
+# リストアをまたいで開いているセッションの書き込みが失われないことのテスト
+def test_restore_backup_with_open_session(database, backup_dir):
+    database_path, engine = database
+    add_asset(engine, "復元前の資産")
+    name = backup.create_backup(backup_dir=backup_dir, database_path=database_path)["name"]
+    add_asset(engine, "バックアップ後の資産")
+
+    with Session(engine) as db:
+        assert len(db.query(models.Asset).all()) == 2
+
+        backup.restore_backup(name, backup_dir=backup_dir, database_path=database_path)
+
+        assert [asset.name for asset in db.query(models.Asset)] == ["復元前の資産"]
+        add_asset(engine, "復元後の資産")
+        db.add(models.Asset(name="開いていたセッションの資産", ticker="TEST", type="株式"))
+        db.commit()
+
+    assert asset_names(engine) == ["復元前の資産", "復元後の資産", "開いていたセッションの資産"]
+
+# 同時に実行された復元が互いの一時ファイルを壊さないことのテスト
+def test_overlapping_restores(database, backup_dir):
+    database_path, engine = database
+    add_asset(engine, "最初の資産")
+    first = backup.create_backup(backup_dir=backup_dir, database_path=database_path)["name"]
+    add_asset(engine, "二つ目の資産")
+    second = backup.create_backup(backup_dir=backup_dir, database_path=database_path)["name"]
+
+    errors = []
+    def restore(name):
+        try:
+            backup.restore_backup(name, backup_dir=backup_dir, database_path=database_path)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=restore, args=(name,)) for name in (first, second) * 3]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert asset_names(engine) in (["最初の資産"], ["最初の資産", "二つ目の資産"])
+    assert [name for name in os.listdir(os.path.dirname(database_path))
+            if name.endswith(".restore")] == []
+
+# バックアップの一時ファイルが消えていた場合に空のデータベースで上書きしないことのテスト
+def test_restore_fails_when_copy_is_missing(database, backup_dir, monkeypatch):
+    database_path, engine = database
+    add_asset(engine, "復元前の資産")
+    name = backup.create_backup(backup_dir=backup_dir, database_path=database_path)["name"]
+
+    # コピー先の一時ファイルが他の処理に消される
+    def copy_then_lose(src, dst):
+        if os.path.exists(dst):
+            os.remove(dst)
+    monkeypatch.setattr(backup.shutil, "copyfile", copy_then_lose)
+
+    with pytest.raises(OperationalError):
+        backup.restore_backup(name, backup_dir=backup_dir, database_path=database_path)
+    assert asset_names(engine) == ["復元前の資産"]